@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/21 16:40
+# @Version     : Python 3.12.2
+"""
+命令行冷启动基准测试
+
+在新的解释器中执行 funny --list, 统计耗时并检查没有导入较重的模块,
+再在临时目录中生成大量虚构的包元数据(.dist-info), 每个包通过入口点注册一个插件,
+加入 sys.path 后重复测试, 确认已安装的插件数量增加时启动耗时仍然较低
+
+    python benchmarks/import_time.py [-n 次数] [-p 虚构插件数] [--max-ms 上限]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# 启动时不允许导入的模块
+HEAVY_MODULES = ['requests', 'urllib3', 'sqlite3', 'xmltodict', 'simple_tools', 'download', 'plugins.zhihu']
+
+SCRIPT = '''
+import io, json, sys, time
+start = time.perf_counter()
+from utils import cli
+stdout, sys.stdout = sys.stdout, io.StringIO()
+try:
+    cli.main(['--list'])
+except SystemExit:
+    pass
+sys.stdout = stdout
+print(json.dumps({
+    'elapsed': time.perf_counter() - start,
+    'heavy': [name for name in %r if name in sys.modules],
+}))
+'''
+
+
+def make_plugins(root: Path, plugins_num: int):
+    """
+    生成虚构的包元数据, 每个包通过入口点注册一个插件
+    :param root: 加入 sys.path 的目录
+    :param plugins_num: 虚构插件数
+    :return:
+    """
+    for i in range(plugins_num):
+        dist_info = root / f'fake_plugin{i}-1.0.dist-info'
+        dist_info.mkdir()
+        (dist_info / 'METADATA').write_text(f'Metadata-Version: 2.1\nName: fake-plugin{i}\nVersion: 1.0\n')
+        (dist_info / 'entry_points.txt').write_text(f'[little_funny.plugins]\nfake{i} = fake.plugin{i}:main\n')
+
+
+def measure(plugins_num: int, number: int) -> dict:
+    elapsed = []
+    heavy = set()
+    with tempfile.TemporaryDirectory() as root:
+        make_plugins(Path(root), plugins_num)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+        for _ in range(number):
+            output = subprocess.run([sys.executable, '-c', SCRIPT % (HEAVY_MODULES,)], cwd=ROOT, env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            result = json.loads(output)
+            elapsed.append(result['elapsed'] * 1000)
+            heavy.update(result['heavy'])
+    return {'median': statistics.median(elapsed), 'heavy': sorted(heavy)}
+
+
+def main():
+    parser = argparse.ArgumentParser(usage='Import Time Benchmark', description=' --help')
+    parser.add_argument('-n', '--number', type=int, default=10, help='runs of each case', dest='number')
+    parser.add_argument('-p', '--plugins', type=int, default=100, help='fake plugins num', dest='plugins_num')
+    parser.add_argument('--max-ms', type=float, default=50, help='max median startup time(ms)', dest='max_ms')
+    args = parser.parse_args()
+    failed = False
+    for plugins_num in [0, args.plugins_num]:
+        result = measure(plugins_num, args.number)
+        print(f'plugins: {plugins_num:>5}, median: {result["median"]:.2f}ms, heavy modules: {result["heavy"]}')
+        failed |= bool(result['heavy']) or result['median'] > args.max_ms
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
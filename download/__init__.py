@@ -90,20 +90,27 @@ requests无法处理连接后服务器拒绝响应的情况,会持续阻塞
 方案五: 使用一个线程来监听其他线程的状态, 超时则结束请求, 不引入任何三方库, 但需要手动实现细节.
 """
 import abc
-import copy
-import itertools
 import logging
 import math
+import queue
 import shutil
+import socket
+import sqlite3
+import threading
 import time
 import typing
+from concurrent.futures import Future, wait
 from concurrent.futures.thread import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 
 import requests
 
+from download.cache import CacheEntry, DownloadCache
 from download.exceptions import *
+from download.merger import FileMerger
+from download.stream import DownloadStream
+from download.tasks import TaskTable, TaskView
 
 
 @dataclass
@@ -127,6 +134,14 @@ class Task(object):
 class DownloadStatus(object):
     error: DownloadException
     task: Task
+    hedge: 'Hedge' = None
+
+
+@dataclass
+class Hedge(object):
+    """对冲下载: 切片已下载的前cut字节保留在原文件, 剩余部分下载到path"""
+    cut: int
+    path: Path
 
 
 DEFAULT_HEADERS = {
@@ -137,7 +152,8 @@ DEFAULT_HEADERS = {
 
 class Downloader(metaclass=abc.ABCMeta):
     def __init__(self, url, headers, output_dir: Path, output_file: Path, logger: logging.Logger,
-                 timeout: float = 30, threads_num: int = 5):
+                 timeout: float = 30, threads_num: int = 5, resolver: typing.Callable[[], str] = None,
+                 cache: DownloadCache = None, cache_key: str = None):
         # 下载状态记录字典
         # self.statuses: typing.Dict[int, RequestStatus] = {}
         self.timeout = timeout
@@ -152,31 +168,62 @@ class Downloader(metaclass=abc.ABCMeta):
         self.threads_num = threads_num
         self.stop_status_codes = [403]
         self.chunk_size = 1024 * 1024
+        # 切片大小, 为空时按线程数平分, 最大50M
+        self.slice_size = None
         self.logger = logger
-        self.tasks = []
+        self.tasks = TaskTable(url, {}, ())
         self.status_code = 200
-
-    def build_tasks(self):
+        # 地址失效时重新解析下载地址
+        self.resolver = resolver
+        self.expired_urls = set()
+        self.resolve_lock = threading.Lock()
+        # 连续的切片下载完成后立即追加合并
+        self.merger = FileMerger(output_file.with_name(f'{output_file.name}.part'), logger, self.chunk_size)
+        self.merged_num = 0
+        # 尾部对冲: 剩余任务数不超过阈值且有空闲线程时, 使用新的连接重复下载剩余的范围, 先完成的生效
+        self.endgame_threshold = 2
+        # 对冲额外下载的字节数上限占文件大小的比例
+        self.endgame_ratio = 0.25
+        self.hedged_size = 0
+        self.hedges: typing.Dict[int, Hedge] = {}
+        # 执行中的请求, 任务确认或停止下载时关闭落后的连接
+        self.responses: typing.Dict[int, typing.Set[requests.Response]] = {}
+        self.responses_lock = threading.Lock()
+        # 本地下载缓存, 默认以下载地址作为资源键
+        self.cache = cache
+        self.cache_key = cache_key or url
+        self.cache_entry: typing.Optional[CacheEntry] = None
+        self.is_cache_hit = False
+        self.etag = None
+        self.last_modified = None
+
+    def build_tasks(self, slice_size: int = None) -> TaskTable:
+        """
+        请求文件大小并切分下载任务
+        :param slice_size: 切片大小, 为空时使用 self.slice_size
+        :return:
+        """
         headers = self.build_headers(self.headers)
         if 'range' not in headers:
             headers['range'] = 'bytes=0-'
+        if self.cache_entry is not None:
+            headers.update(DownloadCache.conditional_headers(self.cache_entry))
         resp = requests.request('get', self.url, headers=headers, stream=True, timeout=self.timeout)
+        if resp.status_code in self.stop_status_codes and self.refresh_url(self.url):
+            resp.close()
+            resp = requests.request('get', self.url, headers=headers, stream=True, timeout=self.timeout)
+        resp.close()
+        if self.cache_entry is not None and resp.status_code == 304:
+            self.is_cache_hit = True
+            return TaskTable(resp.url, {}, ())
         resp.raise_for_status()
         content_range = int(resp.headers['Content-Range'].split('/', 1)[-1])
-        memory_size = min(50 * 1024 * 1024, math.ceil(content_range / self.threads_num))
-        tasks = []
-        serial_number = 0
-        for start_position in itertools.count(0, memory_size):
-            if start_position >= content_range:
-                break
-            tasks.append(Task(
-                url=resp.url,
-                slice=(start_position, 0, min(start_position + memory_size, content_range) - 1),
-                headers=copy.deepcopy(self.headers),
-                serial_number=serial_number
-            ))
-            serial_number += 1
-        return tasks
+        self.etag, self.last_modified = resp.headers.get('ETag'), resp.headers.get('Last-Modified')
+        if self.cache_entry is not None and DownloadCache.is_fresh(self.cache_entry, resp, content_range):
+            self.is_cache_hit = True
+            return TaskTable(resp.url, {}, ())
+        memory_size = slice_size or self.slice_size or min(50 * 1024 * 1024, math.ceil(content_range / self.threads_num))
+        return TaskTable.from_range(resp.url, self.build_headers(self.headers), content_range, memory_size)
 
     @staticmethod
     def build_headers(headers: dict) -> dict:
@@ -192,12 +239,40 @@ class Downloader(metaclass=abc.ABCMeta):
             headers['user-agent'] = DEFAULT_HEADERS['user-agent']
         return headers
 
-    def raise_for_status(self, response: requests.Response):
+    def refresh_url(self, url: str) -> bool:
+        """
+        重新解析下载地址, 并更新所有任务的下载地址
+
+        多个线程同时遇到地址失效时只解析一次, 其余线程直接使用新的地址重试
+        :param url: 已失效的下载地址
+        :return: 是否可以使用新的地址重试
+        """
+        if self.resolver is None:
+            return False
+        with self.resolve_lock:
+            if url in self.expired_urls:
+                return True
+            if len(self.expired_urls) >= self.max_times:
+                return False
+            self.expired_urls.add(url)
+            try:
+                self.url = self.resolver()
+            except Exception as e:
+                self.logger.warning(f'重新解析下载地址失败: {e}')
+                return False
+            self.logger.debug(f'下载地址已失效, 第{len(self.expired_urls)}次重新解析: {self.url}')
+            self.tasks.set_url(self.url)
+        return True
+
+    def raise_for_status(self, response: requests.Response, url: str = None):
         """
         状态码异常时抛出错误
         :param response: 响应
+        :param url: 请求的下载地址, 用于地址失效时重新解析
         :return:
         """
+        if response.status_code in self.stop_status_codes and self.refresh_url(url or response.url):
+            raise RequestError(f'地址失效: {response.status_code}')
         if response.status_code in self.stop_status_codes:
             self.logger.warning(f'异常状态码: {response.status_code}, 终止程序运行！')
             self.status_code = response.status_code
@@ -213,21 +288,124 @@ class Downloader(metaclass=abc.ABCMeta):
         是否所有的下载任务都已经确认
         :return:
         """
-        for task in self.tasks:
-            if task.confirmed is False:
-                return False
-        return True
+        return self.tasks.remaining == 0
 
     def concurrent(self):
         """
         并发下载任务
         :return:
         """
-        with ThreadPoolExecutor(max_workers=self.threads_num) as executor:
-            while not (self.is_stop_all or self.is_all_tasks_confirmed):
-                for download in executor.map(self.download, [task for task in self.tasks if task.confirmed is False]):
+        # 执行中的下载, 对应的任务是否为对冲下载
+        running: typing.Dict[Future, bool] = {}
+        # 已完成的下载, 使用队列而不是wait, wait每次调用都要遍历所有执行中的下载
+        completed = queue.Queue()
+        # 执行中的原下载的任务序号, 已对冲的任务序号
+        downloading, hedged = set(), set()
+        executor = ThreadPoolExecutor(max_workers=self.threads_num)
+
+        def submit(future: Future, is_hedge: bool):
+            running[future] = is_hedge
+            future.add_done_callback(completed.put)
+
+        try:
+            # 所有任务只提交一次, 之后只重新提交下载失败的任务
+            for task in self.tasks.pending_tasks():
+                downloading.add(task.index)
+                submit(executor.submit(self.download, task), False)
+            while running and not (self.is_stop_all or self.is_all_tasks_confirmed):
+                if self.tasks.remaining <= self.endgame_threshold and len(running) < self.threads_num:
+                    for task in self.hedge_candidates(downloading - hedged)[:self.threads_num - len(running)]:
+                        if future := self.submit_hedge(executor, task):
+                            hedged.add(task.index)
+                            submit(future, True)
+                done = [completed.get()]
+                while not completed.empty():
+                    done.append(completed.get())
+                for future in done:
+                    download = future.result()
+                    task = download.task
+                    if running.pop(future):
+                        self.refund_hedge(task, download.hedge)
+                    else:
+                        downloading.discard(task.index)
+                    if task.confirmed:
+                        continue
                     if download.error.message == DownloadSuccess.__name__:
-                        download.task.confirmed = True
+                        if download.hedge is not None:
+                            self.logger.debug(f'对冲下载先完成: {download.hedge.path}')
+                            self.hedges[task.index] = download.hedge
+                        task.confirmed = True
+                        self.close_responses(task.index)
+                    elif download.hedge is None and not self.is_stop_all:
+                        downloading.add(task.index)
+                        submit(executor.submit(self.download, task), False)
+                self.merge_ready()
+        finally:
+            # 所有任务确认后, 剩余的只有对冲中落后的下载, 连接已关闭
+            # 等待其退出后才能删除临时文件夹, 否则仍打开的切片文件可能无法删除(Windows), 最多等待timeout
+            is_all_tasks_confirmed = self.is_all_tasks_confirmed
+            executor.shutdown(wait=not is_all_tasks_confirmed, cancel_futures=True)
+            if is_all_tasks_confirmed and running:
+                wait(running, timeout=self.timeout)
+
+    def hedge_candidates(self, indexes: typing.Iterable[int]) -> typing.List[TaskView]:
+        """
+        执行中的原下载按下载进度从小到大排序, 进度最慢的优先对冲
+        :param indexes: 任务序号
+        :return:
+        """
+        def progress(task: TaskView) -> float:
+            path = self.task_path(task)
+            start, _, end = task.slice
+            return (path.stat().st_size if path.exists() else 0) / (end - start + 1)
+
+        tasks = [self.tasks[index] for index in indexes if not self.tasks.confirmed[index]]
+        return sorted(tasks, key=progress)
+
+    def submit_hedge(self, executor: ThreadPoolExecutor, task: TaskView) -> typing.Optional[Future]:
+        """
+        提交对冲下载, 从原下载已写入的位置开始下载剩余范围
+
+        提交时按剩余范围预占额外下载的额度, 对冲结束后退还未下载的部分
+        :param executor: 线程池
+        :param task: 任务
+        :return: 超过额外下载上限时返回None
+        """
+        path = self.task_path(task)
+        start, _, end = task.slice
+        cut = path.stat().st_size if path.exists() else 0
+        size = end - start - cut + 1
+        if size <= 0 or self.hedged_size + size > self.endgame_ratio * (self.tasks.ends[-1] + 1):
+            return None
+        self.hedged_size += size
+        self.logger.debug(f'对冲下载: {path}, {start + cut}-{end}')
+        return executor.submit(self.hedge, task, Hedge(cut, path.with_name(f'{path.name}.hedge')))
+
+    def refund_hedge(self, task: TaskView, hedge: Hedge):
+        """
+        退还对冲下载未使用的额度, 只计算实际下载的字节数
+        :param task: 任务
+        :param hedge: 对冲下载
+        :return:
+        """
+        start, _, end = task.slice
+        received = hedge.path.stat().st_size if hedge.path.exists() else 0
+        self.hedged_size -= end - start - hedge.cut + 1 - received
+
+    def hedge(self, task: TaskView, hedge: Hedge) -> DownloadStatus:
+        try:
+            with open(hedge.path, 'wb') as f:
+                for chunk in self.iter_chunks(task, hedge.cut):
+                    f.write(chunk)
+            start, _, end = task.slice
+            if start + hedge.cut + hedge.path.stat().st_size <= end:
+                raise ContentLengthError(f'{start + hedge.cut + hedge.path.stat().st_size}-{end}')
+            raise DownloadSuccess()
+        except DownloadException as e:
+            error = e
+        except requests.exceptions.RequestException as e:
+            error = RequestError(type(e).__module__ + '.' + type(e).__name__)
+        return DownloadStatus(error, task, hedge)
 
     # def watchdog(self):
     #     """监测每个线程的下载时间,超时则停止连接"""
@@ -238,15 +416,20 @@ class Downloader(metaclass=abc.ABCMeta):
     #             # 关闭连接
     #             status.response.close()
 
-    def download(self, task: Task) -> DownloadStatus:
-        path = self.temp_dir / f'{task.serial_number:05}'
+    def task_path(self, task: TaskView) -> Path:
+        return self.temp_dir / f'{task.serial_number:05}'
+
+    def download(self, task: TaskView) -> DownloadStatus:
+        path = self.task_path(task)
         try:
             if self.is_stop_all:
                 raise StopAllDownloadTasksError()
             start, offset, end = task.slice
-            if start + offset > end:
+            if start + offset > end + 1:
                 self.logger.warning(f'切片异常: {start + offset}-{end}')
                 raise ValueError(f'切片异常: {start + offset}-{end}')
+            if start + offset == end + 1:
+                raise DownloadSuccess()
             task.download_times += 1
             if task.download_times > self.max_times:
                 self.logger.warning(f'已达到下载上限：{self.max_times}, 终止程序运行')
@@ -259,8 +442,8 @@ class Downloader(metaclass=abc.ABCMeta):
             except requests.exceptions.RequestException as e:
                 raise RequestError(type(e).__module__ + '.' + type(e).__name__)
             finally:
-                task.slice = start, path.stat().st_size, end
-            if task.slice[2] - task.slice[1] - task.slice[0] > 100:
+                task.slice = start, path.stat().st_size if path.exists() else offset, end
+            if task.slice[0] + task.slice[1] <= task.slice[2]:
                 raise ContentLengthError(f'{task.slice[0] + task.slice[1]}-{task.slice[2]}')
             raise DownloadSuccess()
         except DownloadException as e:
@@ -268,31 +451,122 @@ class Downloader(metaclass=abc.ABCMeta):
         except Exception as e:
             self.is_stop_all = True
             raise e
-        if error.message not in [DownloadSuccess.__name__, StopAllDownloadTasksError.__name__]:
+        if error.message not in [DownloadSuccess.__name__, StopAllDownloadTasksError.__name__] and not task.confirmed:
             self.logger.debug(f'下载失败: {error}, {path}')
         return DownloadStatus(error, task)
 
-    def save(self, task: Task, path: Path):
+    def iter_chunks(self, task: TaskView, offset: int = None) -> typing.Iterator[bytes]:
+        """
+        请求切片剩余的范围, 逐块返回数据, 超时或任务已被确认后停止
+        :param task: 任务
+        :param offset: 开始的偏移量, 为空时使用任务记录的偏移量
+        :return:
+        """
         url = task.url
-        headers = task.headers
-        start, offset, end = task.slice
-        headers['range'] = f"bytes={start + offset}-{end}"
-        chunk_size = min(self.chunk_size, end - start - offset)
+        start, task_offset, end = task.slice
+        if offset is None:
+            offset = task_offset
+        # 共享的请求头只读, 每次请求单独构建range
+        headers = dict(task.headers, range=f"bytes={start + offset}-{end}")
+        size = end - start - offset + 1
+        chunk_size = min(self.chunk_size, size)
         start_time = time.time()
         with requests.request('get', url, headers=headers, stream=True, timeout=self.timeout) as resp:
-            self.raise_for_status(resp)
-            count = 0
-            with open(path, 'ab') as f:
+            with self.responses_lock:
+                self.responses.setdefault(task.index, set()).add(resp)
+            try:
+                self.raise_for_status(resp, url)
+                count = 0
                 for chunk in resp.iter_content(chunk_size):
-                    f.write(chunk)
-                    f.flush()
+                    # 任务已被其他下载确认时丢弃收到的数据, 不再写入
+                    if task.confirmed or self.is_stop_all:
+                        break
+                    chunk = chunk[:size - count]
                     count += len(chunk)
-                    if count >= end - start - offset:
+                    yield chunk
+                    if count >= size:
                         break
                     if time.time() - start_time > self.timeout:
-                        if count < end - start - offset:
-                            self.logger.debug(f'超时了, count: {count}, {end - start - offset + 1}')
+                        self.logger.debug(f'超时了, count: {count}, {size}')
                         break
+            finally:
+                with self.responses_lock:
+                    if (responses := self.responses.get(task.index)) is not None:
+                        responses.discard(resp)
+                        if not responses:
+                            del self.responses[task.index]
+
+    def close_responses(self, index: int = None):
+        """
+        关闭执行中的请求的连接, 阻塞在读取中的线程立即返回, 不用等到超时
+        :param index: 任务序号, 为空时关闭所有请求
+        :return:
+        """
+        with self.responses_lock:
+            if index is None:
+                responses = [resp for resps in self.responses.values() for resp in resps]
+                self.responses.clear()
+            else:
+                responses = list(self.responses.pop(index, ()))
+        for resp in responses:
+            # 只关闭响应不会唤醒阻塞在recv中的线程, 需要shutdown套接字
+            sock = getattr(getattr(resp.raw, '_connection', None), 'sock', None)
+            try:
+                if sock is not None:
+                    sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def save(self, task: TaskView, path: Path):
+        with open(path, 'ab') as f:
+            for chunk in self.iter_chunks(task):
+                f.write(chunk)
+                f.flush()
+
+    def fetch(self, task: TaskView) -> bytes:
+        """
+        下载切片到内存, 失败时从已下载的位置继续, 用于流式输出
+        :param task: 任务
+        :return: 切片数据
+        """
+        buffer = bytearray()
+        start, _, end = task.slice
+        while True:
+            if self.is_stop_all:
+                raise StopAllDownloadTasksError()
+            task.download_times += 1
+            if task.download_times > self.max_times:
+                self.is_stop_all = True
+                raise ReachMaxDownloadLimitError(f'download_times: {task.download_times}')
+            try:
+                for chunk in self.iter_chunks(task):
+                    buffer += chunk
+                    task.slice = start, len(buffer), end
+            except requests.exceptions.RequestException as e:
+                self.logger.debug(f'下载失败: {type(e).__name__}, 第{task.download_times}次下载: {task.slice}')
+            except RequestError as e:
+                self.logger.debug(f'下载失败: {e}, 第{task.download_times}次下载: {task.slice}')
+            if start + len(buffer) > end:
+                task.confirmed = True
+                return bytes(buffer)
+
+    def stream(self, slice_size: int = 4 * 1024 * 1024, memory_size: int = 64 * 1024 * 1024) -> DownloadStream:
+        """
+        流式下载, 按顺序读取已下载的数据, 不写入磁盘
+        :param slice_size: 切片大小
+        :param memory_size: 已下载未读取数据的内存上限
+        :return: 可读的文件对象
+        """
+        self.tasks = self.build_tasks(slice_size)
+        if not isinstance(self.tasks, TaskTable):
+            self.tasks = TaskTable.from_tasks(self.tasks)
+        self.logger.debug(f'总任务数：{len(self.tasks)}')
+        return DownloadStream(self.tasks, self.fetch, self.threads_num, max(memory_size // slice_size, 1), self.stop)
+
+    def stop(self):
+        """停止所有下载, 关闭执行中的请求的连接"""
+        self.is_stop_all = True
+        self.close_responses()
 
     def wipe(self):
         self.logger.debug(f'删除缓存文件夹: {self.temp_dir}')
@@ -311,19 +585,30 @@ class Downloader(metaclass=abc.ABCMeta):
             path.unlink()
         if not files:
             return False
-        files[0].rename(path)
-        with open(path, 'ab') as fa:
-            for file in files[1:]:
-                with open(file, 'rb') as fr:
-                    while True:
-                        chunk = fr.read(self.chunk_size)
-                        if not chunk:
-                            break
-                        fa.write(chunk)
-                        fa.flush()
-                if file.exists():
-                    file.unlink()
-        return True
+        merger = FileMerger(path.with_name(f'{path.name}.part'), self.logger, self.chunk_size)
+        try:
+            for file in files:
+                merger.append(file)
+        except Exception:
+            merger.abort()
+            raise
+        return merger.commit(path)
+
+    def merge_ready(self):
+        """
+        合并已下载完成的连续切片
+        :return:
+        """
+        while self.merged_num < len(self.tasks) and self.tasks.confirmed[self.merged_num]:
+            path = self.task_path(self.tasks[self.merged_num])
+            if hedge := self.hedges.pop(self.merged_num, None):
+                # 原下载可能仍在写入, 只合并对冲开始前已写入的部分, 文件由wipe删除
+                # 对冲开始时原下载可能还未创建文件
+                if hedge.cut:
+                    self.merger.append(path, hedge.cut, remove=False)
+                path = hedge.path
+            self.merger.append(path)
+            self.merged_num += 1
 
     def merge_temp_files(self) -> bool:
         """
@@ -333,10 +618,40 @@ class Downloader(metaclass=abc.ABCMeta):
         if self.output_file.exists():
             self.output_file.unlink()
         self.logger.debug(f'合并文件: {self.temp_dir} -> {self.output_file}')
-        is_merge_success = self.merge_files(sorted(self.temp_dir.iterdir()), self.output_file)
+        self.merge_ready()
+        is_merge_success = self.merged_num == len(self.tasks) and self.merger.commit(self.output_file)
         self.logger.debug(f'is_merge_success：{is_merge_success}')
         return is_merge_success
 
+    def load_cache(self) -> bool:
+        """
+        缓存有效时从缓存生成输出文件, 失败时重新构建下载任务
+        :return: 是否已从缓存生成输出文件
+        """
+        try:
+            self.cache.materialize(self.cache_entry, self.output_file)
+            return True
+        except OSError as e:
+            self.logger.warning(f'读取缓存失败, 重新下载: {e}')
+        self.is_cache_hit = False
+        self.cache_entry = None
+        self.tasks = self.build_tasks()
+        return False
+
+    def save_cache(self):
+        """
+        缓存下载完成的文件, 缓存失败不影响下载结果
+
+        缓存成功后 cache_entry 记录文件的sha256, 调用方可直接使用, 无需再次读取文件
+        :return:
+        """
+        if self.cache is None:
+            return
+        try:
+            self.cache_entry = self.cache.store(self.cache_key, self.output_file, self.etag, self.last_modified)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f'缓存文件失败: {e}')
+
     def start(self):
         """
         开启下载程序
@@ -347,15 +662,26 @@ class Downloader(metaclass=abc.ABCMeta):
         :return:
         """
         try:
+            self.is_cache_hit = False
+            self.cache_entry = self.cache.lookup(self.cache_key) if self.cache is not None else None
             self.tasks = self.build_tasks()
+            if self.is_cache_hit and self.load_cache():
+                return self
+            if not isinstance(self.tasks, TaskTable):
+                self.tasks = TaskTable.from_tasks(self.tasks)
             self.logger.debug(f'总任务数：{len(self.tasks)}')
             self.wipe()
             self.temp_dir.mkdir(parents=True, exist_ok=True)
+            self.merged_num = 0
+            self.hedged_size = 0
+            self.hedges.clear()
+            self.responses.clear()
             self.concurrent()
             # self.logger.error(f'IS_STOP_ALL: {self.is_stop_all}')
-            if self.is_all_tasks_confirmed:
-                self.merge_temp_files()
+            if self.is_all_tasks_confirmed and self.merge_temp_files():
+                self.save_cache()
         except Exception as e:
             self.logger.exception(f'下载异常, 终止程序运行: {e}')
+        self.merger.abort()
         self.wipe()
         return self
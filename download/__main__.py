@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/14 17:20
+# @Version     : Python 3.12.2
+import argparse
+import logging
+import shutil
+import sys
+import traceback
+from pathlib import Path
+
+from download import Downloader
+from download.exceptions import DownloadException
+
+
+def download(args):
+    headers = dict(header.split(':', 1) for header in args.headers)
+    headers = {k.strip(): v.strip() for k, v in headers.items()}
+    logger = logging.getLogger('download')
+    if args.output == '-':
+        # 流式输出到标准输出, 不写入磁盘
+        downloader = Downloader(args.url, headers, Path('.'), Path('-'), logger,
+                                timeout=args.timeout, threads_num=args.threads_num)
+        with downloader.stream(memory_size=args.memory_size * 1024 * 1024) as stream:
+            shutil.copyfileobj(stream, sys.stdout.buffer, downloader.chunk_size)
+        sys.stdout.buffer.flush()
+        return
+    output_file = Path(args.output or Path(args.url.split('?', 1)[0]).name or 'download')
+    downloader = Downloader(args.url, headers, output_file.with_name(f'.{output_file.name}.tmp'), output_file,
+                            logger, timeout=args.timeout, threads_num=args.threads_num).start()
+    if not downloader.is_all_tasks_confirmed:
+        raise DownloadException(f'下载失败: {args.url}')
+    print(f'Completed! Output file named "{output_file}"', file=sys.stderr)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(usage='Downloader', description=' --help')
+    parser.add_argument(dest='url', type=str, help='url')
+    parser.add_argument('-o', '--output', required=False, type=str, help='output file, "-" for stdout',
+                        dest='output')
+    parser.add_argument('-H', '--header', action='append', default=[], help='request header, such as "Key: Value"',
+                        dest='headers')
+    parser.add_argument('-t', '--threads', type=int, default=5, help='threads num', dest='threads_num')
+    parser.add_argument('-T', '--timeout', type=float, default=30, help='timeout', dest='timeout')
+    parser.add_argument('-m', '--memory-size', type=int, default=64,
+                        help='stream mode only, memory size(MB) of buffered data', dest='memory_size')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show debug log', dest='verbose')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+    error_code = 0
+    try:
+        download(args)
+    except (KeyboardInterrupt, Exception):
+        traceback.print_exc()
+        error_code = 130
+    sys.exit(error_code)
+
+
+if __name__ == '__main__':
+    main()
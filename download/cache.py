@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/18 10:03
+# @Version     : Python 3.12.2
+"""
+本地下载缓存
+
+重复运行或多个程序下载相同的资源时, 不再重复下载:
+    1. 文件按内容的sha256存储, 内容相同的资源只存储一份
+    2. 索引记录资源键(默认为下载地址)对应的ETag, Last-Modified, 文件大小
+    3. 下载前使用条件请求验证缓存, 未变化时通过reflink或复制生成输出文件
+       不使用硬链接, 硬链接的输出文件被修改时缓存文件也会被修改
+    4. 缓存总大小超过上限时, 按最近使用时间淘汰
+"""
+import hashlib
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import requests
+
+DEFAULT_CACHE_DIR = Path.home() / '.cache' / 'little-funny' / 'download'
+# linux ioctl FICLONE
+FICLONE = 0x40049409
+
+
+@dataclass
+class CacheEntry(object):
+    key: str
+    digest: str
+    etag: str
+    last_modified: str
+    size: int
+
+
+def reflink(src: Path, dst: Path):
+    """写时复制, 仅支持linux上的btrfs, xfs等文件系统"""
+    if fcntl is None:
+        raise OSError('reflink is not supported')
+    with open(src, 'rb') as fr, open(dst, 'wb') as fw:
+        try:
+            fcntl.ioctl(fw.fileno(), FICLONE, fr.fileno())
+        except OSError:
+            fw.close()
+            dst.unlink()
+            raise
+
+
+def clone_or_copy(src: Path, dst: Path) -> str:
+    """
+    优先reflink, 不支持时复制
+    :param src: 源文件
+    :param dst: 目标文件
+    :return: 使用的方式
+    """
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def sha256sum(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class DownloadCache(object):
+    def __init__(self, root: Path = DEFAULT_CACHE_DIR, max_size: int = 10 * 1024 * 1024 * 1024,
+                 logger: logging.Logger = None):
+        """
+        :param root: 缓存目录
+        :param max_size: 缓存总大小上限
+        :param logger: 日志
+        """
+        self.root = root
+        self.objects_dir = root / 'objects'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.logger = logger or logging.getLogger(Path(__file__).stem)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(root / 'index.sqlite3'), check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, digest TEXT NOT NULL, etag TEXT, last_modified TEXT, '
+                'size INTEGER NOT NULL, access_time REAL NOT NULL)'
+            )
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / digest
+
+    def lookup(self, key: str) -> typing.Optional[CacheEntry]:
+        """
+        查找缓存, 缓存文件丢失或大小不一致时删除索引
+        :param key: 资源键
+        :return:
+        """
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT key, digest, etag, last_modified, size FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(*row)
+        path = self.object_path(entry.digest)
+        if not path.exists() or path.stat().st_size != entry.size:
+            self.logger.debug(f'缓存文件异常, 删除缓存: {key}')
+            self.remove(key)
+            return None
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry: CacheEntry) -> dict:
+        """
+        构建验证缓存的条件请求头
+        :param entry: 缓存
+        :return:
+        """
+        headers = {}
+        if entry.etag:
+            headers['if-none-match'] = entry.etag
+        if entry.last_modified:
+            headers['if-modified-since'] = entry.last_modified
+        return headers
+
+    @staticmethod
+    def is_fresh(entry: CacheEntry, response: requests.Response, size: int = None) -> bool:
+        """
+        根据条件请求的响应判断缓存是否有效
+        :param entry: 缓存
+        :param response: 响应
+        :param size: 响应中的文件大小
+        :return:
+        """
+        if response.status_code == 304:
+            return True
+        if size is not None and size != entry.size:
+            return False
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if entry.etag and etag:
+            return entry.etag == etag
+        if entry.last_modified and last_modified:
+            return entry.last_modified == last_modified
+        return False
+
+    def materialize(self, entry: CacheEntry, path: Path) -> str:
+        """
+        从缓存生成输出文件
+        :param entry: 缓存
+        :param path: 输出文件
+        :return: 使用的方式
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists():
+            path.unlink()
+        method = clone_or_copy(self.object_path(entry.digest), path)
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE entries SET access_time = ? WHERE key = ?', (time.time(), entry.key))
+        self.logger.debug(f'命中缓存: {entry.key} -> {path}, {method}')
+        return method
+
+    def store(self, key: str, path: Path, etag: str = None, last_modified: str = None) -> typing.Optional[CacheEntry]:
+        """
+        缓存已下载的文件, 没有ETag和Last-Modified时无法验证缓存, 不缓存
+        :param key: 资源键
+        :param path: 已下载的文件
+        :param etag: ETag
+        :param last_modified: Last-Modified
+        :return:
+        """
+        if not (etag or last_modified):
+            return None
+        size = path.stat().st_size
+        if size > self.max_size:
+            return None
+        entry = CacheEntry(key, sha256sum(path), etag, last_modified, size)
+        object_path = self.object_path(entry.digest)
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = object_path.with_name(f'{object_path.name}.{threading.get_ident()}.tmp')
+            clone_or_copy(path, temp_path)
+            temp_path.replace(object_path)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO entries (key, digest, etag, last_modified, size, access_time) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, entry.digest, etag, last_modified, size, time.time())
+            )
+        self.logger.debug(f'已缓存: {key} -> {object_path}')
+        self.evict()
+        return entry
+
+    def remove(self, key: str):
+        with self.lock, self.conn:
+            row = self.conn.execute('SELECT digest FROM entries WHERE key = ?', (key,)).fetchone()
+            self.conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            if row is None or self.conn.execute('SELECT 1 FROM entries WHERE digest = ?', row).fetchone():
+                return
+        path = self.object_path(row[0])
+        if path.exists():
+            path.unlink()
+
+    def total_size(self) -> int:
+        """缓存文件总大小, 内容相同的缓存只计算一次"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM entries)'
+            ).fetchone()[0]
+
+    def evict(self):
+        """
+        按最近使用时间淘汰缓存, 直到总大小不超过上限
+
+        每次淘汰后重新计算总大小, 文件异常被lookup删除的缓存同样不再计算
+        :return:
+        """
+        with self.lock:
+            keys = [key for key, in self.conn.execute('SELECT key FROM entries ORDER BY access_time')]
+        for key in keys:
+            if self.total_size() <= self.max_size:
+                break
+            if self.lookup(key) is None:
+                continue
+            self.remove(key)
+            self.logger.debug(f'淘汰缓存: {key}')
+
+    def close(self):
+        self.conn.close()
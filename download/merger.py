@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/11 14:27
+# @Version     : Python 3.12.2
+"""
+切片文件合并
+
+逐块读写合并需要把每个字节复制到用户态, 大文件在下载结束时会卡顿很久:
+    1. 优先使用 os.copy_file_range 在内核中复制, 其次使用 os.sendfile(仅linux), 都不支持时退回到逐块读写
+    2. 第一个切片直接改名为合并文件, 不复制
+    3. 下载器在连续的切片下载完成后立即追加合并, 下载结束时只剩最后几个切片需要合并
+合并过程写入 .part 文件, 全部完成后改名为目标文件
+"""
+import errno
+import logging
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+from download.exceptions import MediaMergeError
+
+# 内核复制不可用时的错误码, 出现后退回到下一种方式
+FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSUP,
+                   errno.ENOTSOCK}
+
+
+def copy_by_copy_file_range(fd_in: int, fd_out: int, size: int) -> int:
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(fd_in, fd_out, size - copied)
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+
+def copy_by_sendfile(fd_in: int, fd_out: int, size: int) -> int:
+    copied = 0
+    while copied < size:
+        count = os.sendfile(fd_out, fd_in, copied, size - copied)
+        if count == 0:
+            break
+        copied += count
+    return copied
+
+
+def copy_by_read_write(fd_in: int, fd_out: int, size: int, chunk_size: int = 1024 * 1024) -> int:
+    copied = 0
+    while copied < size:
+        chunk = os.read(fd_in, min(chunk_size, size - copied))
+        if not chunk:
+            break
+        os.write(fd_out, chunk)
+        copied += len(chunk)
+    return copied
+
+
+class FileMerger(object):
+    def __init__(self, path: Path, logger: logging.Logger, chunk_size: int = 1024 * 1024):
+        """
+        :param path: 合并过程中写入的临时文件
+        :param logger: 日志
+        :param chunk_size: 逐块读写时的块大小
+        """
+        self.path = path
+        self.logger = logger
+        self.chunk_size = chunk_size
+        self.fd = None
+        self.methods = []
+        if hasattr(os, 'copy_file_range'):
+            self.methods.append(copy_by_copy_file_range)
+        # 只有linux的sendfile支持写入普通文件, macOS等系统只能写入套接字
+        if hasattr(os, 'sendfile') and sys.platform.startswith('linux'):
+            self.methods.append(copy_by_sendfile)
+        self.size = 0
+        self.copied_size = 0
+        self.elapsed = 0.0
+
+    @property
+    def speed(self) -> float:
+        """合并速度(字节/秒)"""
+        return self.copied_size / self.elapsed if self.elapsed else 0.0
+
+    def copy(self, fd_in: int, size: int) -> int:
+        while self.methods:
+            try:
+                return self.methods[0](fd_in, self.fd, size)
+            except OSError as e:
+                if e.errno not in FALLBACK_ERRNOS:
+                    raise
+                self.logger.debug(f'{self.methods[0].__name__}不可用: {e}, 尝试下一种合并方式')
+                self.methods.pop(0)
+                # 失败的方式可能已复制了一部分, 恢复偏移量
+                os.lseek(fd_in, 0, os.SEEK_SET)
+                os.ftruncate(self.fd, self.size)
+                os.lseek(self.fd, self.size, os.SEEK_SET)
+        return copy_by_read_write(fd_in, self.fd, size, self.chunk_size)
+
+    def append(self, file: Path, size: int = None, remove: bool = True):
+        """
+        追加文件到合并文件, 追加完成后删除该文件
+        :param file: 文件
+        :param size: 只追加文件开头的字节数, 为空时追加整个文件
+        :param remove: 追加完成后是否删除该文件
+        :return:
+        """
+        if self.fd is None:
+            if self.path.exists():
+                self.path.unlink()
+            is_renamed = False
+            if size is None and remove:
+                try:
+                    file.rename(self.path)
+                    is_renamed = True
+                except OSError:
+                    pass
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+            self.size = os.lseek(self.fd, 0, os.SEEK_END)
+            if is_renamed:
+                return
+        start_time = time.time()
+        try:
+            fd_in = os.open(file, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        except FileNotFoundError:
+            # 切片文件丢失时合并结果不完整, 不能提交
+            raise MediaMergeError(f'{file}: 文件不存在')
+        try:
+            if size is None:
+                size = os.fstat(fd_in).st_size
+            copied = self.copy(fd_in, size)
+        finally:
+            os.close(fd_in)
+        if copied != size:
+            raise MediaMergeError(f'{file}: {copied}/{size}')
+        self.size += copied
+        self.copied_size += copied
+        self.elapsed += time.time() - start_time
+        if remove:
+            file.unlink()
+
+    def commit(self, path: Path) -> bool:
+        """
+        合并完成, 改名为目标文件
+        :param path: 目标文件
+        :return:
+        """
+        if self.fd is None:
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+        os.close(self.fd)
+        self.fd = None
+        if path.exists():
+            path.unlink()
+        shutil.move(self.path, path)
+        self.logger.debug(f'合并完成: {self.size}字节, 复制{self.copied_size}字节, '
+                          f'耗时{self.elapsed:.3f}秒, 速度{self.speed / 1024 / 1024:.2f}MB/s')
+        return True
+
+    def abort(self):
+        """放弃合并, 删除合并文件"""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if self.path.exists():
+            self.path.unlink()
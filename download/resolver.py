@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/4 15:20
+# @Version     : Python 3.12.2
+"""
+下载地址解析器
+
+下载地址需要额外请求接口获取, 且带签名的地址存在有效期:
+    1. 按下载顺序, 在当前地址之后的一个窗口内并发预解析地址, 把接口请求从下载的关键路径上移除
+    2. 记录每个地址的过期时间, 过期的地址在使用前重新解析
+    3. 下载过程中地址失效(403)时, 下载器通过 bind 返回的函数重新解析地址
+"""
+import functools
+import logging
+import threading
+import time
+import typing
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlparse
+
+# 签名地址中表示过期时间戳的参数
+EXPIRES_PARAMS = ['expires', 'x-expires', 'x-oss-expires', 'deadline', 'e']
+
+
+@dataclass
+class ResolvedUrl(object):
+    url: str
+    expire_time: float
+
+
+class UrlResolver(object):
+    def __init__(self, fetch: typing.Callable[[str], str], keys: typing.List[str], logger: logging.Logger,
+                 window: int = 5, threads_num: int = 3, ttl: float = 600, margin: float = 60):
+        """
+        :param fetch: 根据键请求下载地址的函数
+        :param keys: 按下载顺序排列的键
+        :param logger: 日志
+        :param window: 预解析窗口大小
+        :param threads_num: 预解析线程数
+        :param ttl: 无法从地址中解析过期时间时使用的有效期(秒)
+        :param margin: 过期时间的提前量(秒), 避免地址在下载过程中过期
+        """
+        self.fetch = fetch
+        self.keys = list(keys)
+        self.positions = {key: index for index, key in enumerate(self.keys)}
+        self.logger = logger
+        self.window = max(window, 0)
+        self.ttl = ttl
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.futures: typing.Dict[str, Future] = {}
+        self.executor = ThreadPoolExecutor(max_workers=max(threads_num, 1))
+
+    def expire_time(self, url: str) -> float:
+        """
+        解析地址的过期时间
+        :param url: 下载地址
+        :return: 过期时间戳
+        """
+        for name, value in parse_qsl(urlparse(url).query):
+            if name.lower() in EXPIRES_PARAMS and value.isdigit() and int(value) > 1e9:
+                return int(value) - self.margin
+        return time.time() + self.ttl - self.margin
+
+    def _fetch(self, key: str) -> ResolvedUrl:
+        url = self.fetch(key)
+        return ResolvedUrl(url, self.expire_time(url))
+
+    def _submit(self, key: str) -> Future:
+        future = self.futures.get(key)
+        if future is None or (future.done() and (
+                future.exception() is not None or future.result().expire_time < time.time())):
+            future = self.futures[key] = self.executor.submit(self._fetch, key)
+        return future
+
+    def prefetch(self, key: str):
+        """
+        预解析键之后窗口内的地址
+        :param key: 当前的键
+        :return:
+        """
+        position = self.positions.get(key, -1)
+        with self.lock:
+            for next_key in self.keys[position + 1:position + 1 + self.window]:
+                self._submit(next_key)
+
+    def resolve(self, key: str) -> str:
+        """
+        获取下载地址, 并预解析之后窗口内的地址
+        :param key: 键
+        :return: 下载地址
+        """
+        with self.lock:
+            future = self._submit(key)
+        self.prefetch(key)
+        resolved = future.result()
+        if resolved.expire_time < time.time():
+            return self.refresh(key)
+        return resolved.url
+
+    def refresh(self, key: str) -> str:
+        """
+        强制重新解析下载地址
+        :param key: 键
+        :return: 下载地址
+        """
+        self.logger.debug(f'重新解析下载地址: {key}')
+        resolved = self._fetch(key)
+        with self.lock:
+            future = self.futures[key] = Future()
+            future.set_result(resolved)
+        return resolved.url
+
+    def bind(self, key: str) -> typing.Callable[[], str]:
+        """
+        绑定键, 返回重新解析地址的函数, 供下载器在地址失效时调用
+        :param key: 键
+        :return:
+        """
+        return functools.partial(self.refresh, key)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
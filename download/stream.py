@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/14 16:35
+# @Version     : Python 3.12.2
+"""
+流式下载
+
+下载完成并合并后才能使用文件, 哈希, 转码, 上传等后续处理需要一直等待:
+    1. 多个线程按顺序并发下载切片到内存, 读取方按顺序读取, 不写入磁盘
+    2. 已下载未读取的切片数量有上限, 读取方消费一个切片后才继续下载下一个切片, 内存占用有界
+"""
+import collections
+import io
+import typing
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
+
+from download.tasks import TaskTable, TaskView
+
+
+class DownloadStream(io.RawIOBase):
+    def __init__(self, tasks: TaskTable, fetch: typing.Callable[[TaskView], bytes], threads_num: int,
+                 buffer_num: int, stop: typing.Callable[[], None] = None):
+        """
+        :param tasks: 任务表
+        :param fetch: 下载切片到内存的函数
+        :param threads_num: 线程数
+        :param buffer_num: 下载中及已下载未读取的切片数量上限
+        :param stop: 关闭时停止执行中的下载的函数
+        """
+        super().__init__()
+        self.tasks = tasks
+        self.fetch = fetch
+        self.stop = stop
+        self.buffer_num = max(buffer_num, 1)
+        self.executor = ThreadPoolExecutor(max_workers=max(threads_num, 1))
+        self.futures: typing.Deque[Future] = collections.deque()
+        self.submitted_num = 0
+        self.buffer = memoryview(b'')
+        self.schedule()
+
+    def schedule(self):
+        while len(self.futures) < self.buffer_num and self.submitted_num < len(self.tasks):
+            self.futures.append(self.executor.submit(self.fetch, self.tasks[self.submitted_num]))
+            self.submitted_num += 1
+
+    def readable(self) -> bool:
+        return True
+
+    def read_slice(self) -> bytes:
+        """
+        读取下一个完整的切片
+        :return: 切片数据, 读取完毕时返回空字节
+        """
+        if self.buffer:
+            data, self.buffer = bytes(self.buffer), memoryview(b'')
+            return data
+        if not self.futures:
+            return b''
+        data = self.futures.popleft().result()
+        self.schedule()
+        return data
+
+    def readinto(self, b) -> int:
+        if not self.buffer:
+            self.buffer = memoryview(self.read_slice())
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def iter_slices(self) -> typing.Iterator[bytes]:
+        while data := self.read_slice():
+            yield data
+
+    def close(self):
+        if not self.closed:
+            # 未开始的下载直接取消, 执行中的下载通过stop停止
+            if self.stop is not None:
+                self.stop()
+            for future in self.futures:
+                future.cancel()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
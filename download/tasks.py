@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/6 09:41
+# @Version     : Python 3.12.2
+"""
+紧凑的下载任务表
+
+切片数量达到上万时, 每个切片一个数据类加一份请求头副本会占用大量内存, 每轮循环扫描全部任务也很耗时:
+    1. 切片位置, 下载次数, 确认状态使用数组存储
+    2. 所有任务共享一份只读的请求头和下载地址
+    3. 待下载任务使用有序字典索引, 剩余任务数和确认操作都是O(1)
+TaskView 提供与 Task 相同的属性, 兼容原有的使用方式
+"""
+import itertools
+import types
+import typing
+from array import array
+
+
+class TaskView(object):
+    """任务视图, 属性读写直接作用于任务表"""
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: 'TaskTable', index: int):
+        self.table = table
+        self.index = index
+
+    @property
+    def url(self) -> str:
+        return self.table.urls.get(self.index, self.table.url)
+
+    @url.setter
+    def url(self, value: str):
+        if value == self.table.url:
+            self.table.urls.pop(self.index, None)
+        else:
+            self.table.urls[self.index] = value
+
+    @property
+    def headers(self) -> typing.Mapping[str, str]:
+        return self.table.headers
+
+    @property
+    def slice(self) -> tuple:
+        return self.table.starts[self.index], self.table.offsets[self.index], self.table.ends[self.index]
+
+    @slice.setter
+    def slice(self, value: tuple):
+        self.table.starts[self.index], self.table.offsets[self.index], self.table.ends[self.index] = value
+
+    @property
+    def serial_number(self) -> int:
+        return self.table.serial_numbers[self.index]
+
+    @property
+    def download_times(self) -> int:
+        return self.table.download_times[self.index]
+
+    @download_times.setter
+    def download_times(self, value: int):
+        self.table.download_times[self.index] = value
+
+    @property
+    def confirmed(self) -> bool:
+        return bool(self.table.confirmed[self.index])
+
+    @confirmed.setter
+    def confirmed(self, value: bool):
+        if value:
+            self.table.confirm(self.index)
+        else:
+            self.table.unconfirm(self.index)
+
+    def __repr__(self):
+        return (f'{type(self).__name__}(url={self.url!r}, slice={self.slice}, serial_number={self.serial_number}, '
+                f'download_times={self.download_times}, confirmed={self.confirmed})')
+
+
+class TaskTable(object):
+    __slots__ = ('url', 'urls', 'headers', 'starts', 'offsets', 'ends', 'serial_numbers', 'download_times',
+                 'confirmed', 'pending')
+
+    def __init__(self, url: str, headers: typing.Mapping[str, str], slices: typing.Iterable[tuple]):
+        """
+        :param url: 下载地址
+        :param headers: 请求头, 所有任务共享
+        :param slices: 切片(start, end)的序列, 包含end
+        """
+        self.url = url
+        # 个别任务的下载地址与公共地址不同时记录在此
+        self.urls: typing.Dict[int, str] = {}
+        self.headers = types.MappingProxyType(dict(headers))
+        self.starts = array('q')
+        self.ends = array('q')
+        for start, end in slices:
+            self.starts.append(start)
+            self.ends.append(end)
+        self.offsets = array('q', [0]) * len(self.starts)
+        self.serial_numbers = array('q', range(len(self.starts)))
+        self.download_times = array('L', [0]) * len(self.starts)
+        self.confirmed = bytearray(len(self.starts))
+        self.pending = dict.fromkeys(range(len(self.starts)))
+
+    @classmethod
+    def from_range(cls, url: str, headers: typing.Mapping[str, str], size: int, slice_size: int) -> 'TaskTable':
+        """
+        按切片大小切分下载范围
+        :param url: 下载地址
+        :param headers: 请求头
+        :param size: 文件大小
+        :param slice_size: 切片大小
+        :return:
+        """
+        return cls(url, headers, (
+            (start, min(start + slice_size, size) - 1) for start in itertools.takewhile(
+                lambda position: position < size, itertools.count(0, slice_size))
+        ))
+
+    @classmethod
+    def from_tasks(cls, tasks: typing.Sequence) -> 'TaskTable':
+        """
+        从 Task 列表构建任务表, 兼容自行构建任务列表的下载器
+        :param tasks: Task 列表
+        :return:
+        """
+        table = cls(tasks[0].url if tasks else '', tasks[0].headers if tasks else {},
+                    ((task.slice[0], task.slice[2]) for task in tasks))
+        for index, task in enumerate(tasks):
+            view = table[index]
+            view.url = task.url
+            view.slice = task.slice
+            view.download_times = task.download_times
+            table.serial_numbers[index] = task.serial_number
+            if task.confirmed:
+                table.confirm(index)
+        return table
+
+    def set_url(self, url: str):
+        """
+        更新所有任务的下载地址
+        :param url: 下载地址
+        :return:
+        """
+        self.url = url
+        self.urls.clear()
+
+    def confirm(self, index: int):
+        self.confirmed[index] = 1
+        self.pending.pop(index, None)
+
+    def unconfirm(self, index: int):
+        self.confirmed[index] = 0
+        self.pending[index] = None
+
+    @property
+    def remaining(self) -> int:
+        """剩余未确认的任务数"""
+        return len(self.pending)
+
+    def pending_tasks(self) -> typing.List[TaskView]:
+        """未确认的任务"""
+        return [TaskView(self, index) for index in self.pending]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index: int) -> TaskView:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return TaskView(self, index)
+
+    def __iter__(self) -> typing.Iterator[TaskView]:
+        return (TaskView(self, index) for index in range(len(self)))
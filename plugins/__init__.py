@@ -2,3 +2,71 @@
 # @Author      : LJQ
 # @Time        : 2024/4/19 11:08
 # @Version     : Python 3.12.2
+"""
+插件注册表
+
+插件以 "模块:函数" 的字符串登记, 发现插件时不导入插件模块, 只有执行插件时才导入:
+    1. PLUGINS 登记内置插件
+    2. 第三方包通过 little_funny.plugins 入口点注册插件, 读取入口点只解析包的元数据
+插件函数接收命令行参数列表, 如 main(argv: list)
+"""
+import importlib
+import typing
+
+ENTRY_POINT_GROUP = 'little_funny.plugins'
+
+# 插件名: (插件函数, 描述)
+PLUGINS = {
+    'zhihu': ('plugins.zhihu:main', '下载知乎知学堂已购课程'),
+}
+
+
+def entry_points(describe: bool = True) -> typing.Dict[str, typing.Tuple[str, str]]:
+    """
+    通过入口点注册的插件
+    :param describe: 是否读取描述, 描述为注册插件的包名, 需要读取每个包的METADATA
+    :return:
+    """
+    from importlib import metadata
+
+    try:
+        eps = metadata.entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10
+        eps = metadata.entry_points().get(ENTRY_POINT_GROUP, [])
+    # Python < 3.10 的入口点没有关联包, 描述为空
+    return {ep.name: (ep.value, ep.dist.name if describe and getattr(ep, 'dist', None) else '') for ep in eps}
+
+
+def discover() -> typing.Dict[str, typing.Tuple[str, str]]:
+    """
+    发现所有插件, 内置插件优先
+    :return: 插件名: (插件函数, 描述)
+    """
+    return {**entry_points(), **PLUGINS}
+
+
+def find(name: str) -> typing.Optional[str]:
+    """
+    查找插件, 内置插件不读取入口点
+    :param name: 插件名
+    :return: 插件函数
+    """
+    if name in PLUGINS:
+        return PLUGINS[name][0]
+    if plugin := entry_points(describe=False).get(name):
+        return plugin[0]
+    return None
+
+
+def load(target: str) -> typing.Callable:
+    """
+    导入插件函数
+    :param target: 模块:函数
+    :return:
+    """
+    module_name, _, attr = target.partition(':')
+    obj = importlib.import_module(module_name)
+    for name in filter(None, attr.split('.')):
+        obj = getattr(obj, name)
+    return obj
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/3 10:12
+# @Version     : Python 3.12.2
+"""
+插件元数据缓存
+
+使用sqlite持久化接口响应与已完成的下载记录, 重复运行时:
+    1. 未过期的接口响应直接从缓存读取, 不再请求接口
+    2. 已完成的下载从索引中判断, 不访问文件系统; 需要时再检查文件大小, 文件被删除或大小不一致时删除记录并重新下载
+"""
+import json
+import sqlite3
+import threading
+import time
+import typing
+from pathlib import Path
+
+
+class MetadataCache(object):
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expire_time REAL NOT NULL)'
+            )
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS downloads ('
+                'path TEXT PRIMARY KEY, size INTEGER NOT NULL, checksum TEXT, finish_time REAL NOT NULL)'
+            )
+        # 已完成下载的索引一次性载入内存, 判断时不访问文件系统
+        self.completed: typing.Dict[str, int] = dict(self.conn.execute('SELECT path, size FROM downloads'))
+
+    def get(self, key: str):
+        """
+        获取未过期的缓存
+        :param key: 缓存键
+        :return: 缓存值, 不存在或已过期时返回None
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT value, expire_time FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float):
+        """
+        设置缓存
+        :param key: 缓存键
+        :param value: 可被json序列化的值
+        :param ttl: 有效期(秒)
+        :return:
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (key, value, expire_time) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            )
+
+    def is_indexed(self, path: Path) -> bool:
+        """
+        是否存在下载记录
+        :param path: 文件路径
+        :return:
+        """
+        return str(path) in self.completed
+
+    def is_completed(self, path: Path, verify: bool = False) -> bool:
+        """
+        是否已完成下载
+        :param path: 文件路径
+        :param verify: 是否检查文件, 文件不存在或大小与记录不一致时删除记录
+        :return:
+        """
+        if (size := self.completed.get(str(path))) is None:
+            return False
+        if not verify:
+            return True
+        try:
+            if path.stat().st_size == size:
+                return True
+        except OSError:
+            pass
+        self.discard(path)
+        return False
+
+    def mark_completed(self, path: Path, size: int = None, checksum: str = None):
+        """
+        记录已完成的下载
+        :param path: 文件路径
+        :param size: 文件大小, 为空时读取文件大小
+        :param checksum: 文件的sha256
+        :return:
+        """
+        if size is None:
+            size = path.stat().st_size
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO downloads (path, size, checksum, finish_time) VALUES (?, ?, ?, ?)',
+                (str(path), size, checksum, time.time())
+            )
+        self.completed[str(path)] = size
+
+    def discard(self, path: Path):
+        """
+        删除下载记录, 用于文件被删除后重新下载
+        :param path: 文件路径
+        :return:
+        """
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM downloads WHERE path = ?', (str(path),))
+        self.completed.pop(str(path), None)
+
+    def close(self):
+        self.conn.close()
@@ -2,13 +2,19 @@
 # @Author      : LJQ
 # @Time        : 2024/4/19 11:09
 # @Version     : Python 3.12.2
+import argparse
 import logging
+import sqlite3
+import sys
 from pathlib import Path
 
 from simple_tools import requestx
 from simple_tools.commons import fix_filename
 
 from download import Downloader
+from download.cache import DownloadCache
+from download.resolver import UrlResolver
+from plugins.cache import MetadataCache
 
 
 class 知学堂(object):
@@ -20,7 +26,12 @@ class 知学堂(object):
         "Accept-Language": "zh-CN,zh;q=0.9",
     }
 
-    def __init__(self, cookie: str = '', download_dir: Path = Path(r'C:\Download\知乎知学堂')):
+    # 已购课程列表变化较少, 课件目录基本不变
+    courses_ttl = 6 * 3600
+    catalog_ttl = 7 * 24 * 3600
+
+    def __init__(self, cookie: str = '', download_dir: Path = Path(r'C:\Download\知乎知学堂'), verify: bool = False,
+                 cache_dir: Path = None):
         self.session = requestx.Sessionx()
         headers = self.headers.copy()
         if cookie:
@@ -28,12 +39,20 @@ class 知学堂(object):
         self.session.headers = headers
         self.download_dir = download_dir
         self.logger = logging.getLogger(Path(__file__).stem)
+        self.cache = MetadataCache(download_dir / '.cache.sqlite3')
+        # 是否检查已下载文件的大小, 默认信任下载索引
+        self.verify = verify
+        # 下载缓存需要额外计算sha256并复制一份文件, 只在指定缓存目录时启用
+        self.download_cache = DownloadCache(cache_dir, logger=self.logger) if cache_dir else None
 
     def 请求课件下载地址(self, file_id: str):
         api = f'https://api.zhihu.com/education/file/{file_id}'
         return self.session.request('get', api).json()['data']['file_url']
 
     def 获取所有的课程(self):
+        if (courses := self.cache.get(cache_key := 'courses')) is not None:
+            print(f'\n已从缓存获取课程 {len(courses)}')
+            return courses
         api = 'https://www.zhihu.com/api/v4/knowledge_school/purchased/courses?type=ordinary_course&limit=6&offset=0'
         courses = []
         pn = 0
@@ -54,6 +73,7 @@ class 知学堂(object):
                 print()
                 break
             api = body['paging']['next']
+        self.cache.set(cache_key, courses, self.courses_ttl)
         return courses
 
     @staticmethod
@@ -85,7 +105,14 @@ class 知学堂(object):
                 })
         return files
 
-    def 获取课程的所有课件(self, course_id: str, course_name: str):
+    def 获取课程的所有课件(self, course_id: str, course_name: str, refresh: bool = False):
+        # 视频地址带签名会过期, 缓存中只保存课件名称和课件编号, 需要下载视频时再重新获取目录
+        cache_key = f'catalog:{course_id}'
+        if not refresh and (catalog := self.cache.get(cache_key)) is not None:
+            print(f'\n已从缓存获取 <{course_name}> 课件')
+            # 兼容之前缓存了视频地址的目录
+            catalog['lessons'] = [{'name': lesson['name']} for lesson in catalog['lessons']]
+            return catalog
         api = f'https://api.zhihu.com/education/training/{course_id}/video_page/catalog?limit=10&offset=0'
         lessons = []
         files = []
@@ -105,12 +132,36 @@ class 知学堂(object):
                 print()
                 break
             api = body['paging']['next']
+        self.cache.set(cache_key, {
+            'lessons': [{'name': lesson['name']} for lesson in lessons],
+            'files': files,
+        }, self.catalog_ttl)
         return {
             'lessons': lessons,
             'files': files,
         }
 
-    def 下载媒资(self, url, filepath: Path):
+    def 是否已下载(self, filepath: Path):
+        # 优先查询下载索引, 索引中不存在时才检查文件, 兼容没有索引之前下载的文件
+        # 默认信任索引, 不检查文件; verify 为True时检查文件大小, 文件被删除或大小不一致时删除记录, 重新下载
+        if self.cache.is_indexed(filepath):
+            return not self.verify or self.cache.is_completed(filepath, verify=True)
+        try:
+            size = filepath.stat().st_size
+        except OSError:
+            return False
+        self.cache.mark_completed(filepath, size)
+        return True
+
+    def 记录已下载(self, filepath: Path, digest: str = None):
+        # 记录失败只影响下次运行是否跳过, 不影响下载结果
+        # 只记录下载缓存已计算的sha256, 不为记录再次读取整个文件
+        try:
+            self.cache.mark_completed(filepath, filepath.stat().st_size, digest)
+        except (OSError, sqlite3.Error) as e:
+            self.logger.warning(f'记录下载失败: {filepath}, {e}')
+
+    def 下载媒资(self, url, filepath: Path, resolver=None, cache_key: str = None):
         filepath.parent.mkdir(exist_ok=True, parents=True)
         download = Downloader(
             url,
@@ -120,35 +171,73 @@ class 知学堂(object):
             self.logger,
             threads_num=5,
             timeout=60,
+            resolver=resolver,
+            cache=self.download_cache,
+            # 签名地址每次都不同, 使用不带参数的地址作为资源键
+            cache_key=cache_key or url.split('?', 1)[0],
         ).start()
-        return download.is_all_tasks_confirmed
+        # 构建任务前失败时任务表为空, is_all_tasks_confirmed 也为True, 需要确认文件已生成
+        if is_success := download.is_all_tasks_confirmed and filepath.exists():
+            self.记录已下载(filepath, download.cache_entry.digest if download.cache_entry else None)
+        return is_success
 
     def 下载所有课程(self):
         # 下载视频
         courses = self.获取所有的课程()
         for course in courses:
             videos = self.获取课程的所有课件(course['id'], course_name := course['name'])
-            for index, video in enumerate(files := videos['files'], start=1):
+            files = videos['files']
+            # 每个课程只判断一次是否已下载, 预解析与下载共用
+            downloaded = {file['file_id'] for file in files
+                          if self.是否已下载(self.download_dir / course_name / fix_filename(file['name']))}
+            # 课件下载地址在下载队列之前预解析, 地址失效时重新解析
+            resolver = UrlResolver(
+                self.请求课件下载地址,
+                [file['file_id'] for file in files if file['file_id'] not in downloaded],
+                self.logger,
+            )
+            for index, video in enumerate(files, start=1):
                 file_id = video['file_id']
                 name = fix_filename(video['name'])
                 print(f'\n正在下载 {index}/{len(files)} <{course_name}> {name}')
-                if (filepath := self.download_dir / course_name / name).exists():
+                if file_id in downloaded:
                     print(f'已存在 {index}/{len(files)} <{course_name}> {name}')
                     continue
-                url = self.请求课件下载地址(file_id)
-                print(f'下载状态: {self.下载媒资(url, filepath)}, {index}/{len(files)} <{course_name}> {name}')
+                url = resolver.resolve(file_id)
+                filepath = self.download_dir / course_name / name
+                print(f'下载状态: {self.下载媒资(url, filepath, resolver.bind(file_id), f"zhihu:file:{file_id}")}, '
+                      f'{index}/{len(files)} <{course_name}> {name}')
+            resolver.close()
 
-            for index, video in enumerate(lessons := videos['lessons'], start=1):
-                url = video['url']
+            lessons = videos['lessons']
+            downloaded = {lesson['name'] for lesson in lessons
+                          if self.是否已下载(self.download_dir / course_name / fix_filename(lesson['name']))}
+            # 缓存的目录不包含视频地址, 有未下载的视频时重新获取目录
+            if len(downloaded) < len(lessons) and 'url' not in lessons[0]:
+                lessons = self.获取课程的所有课件(course['id'], course_name, refresh=True)['lessons']
+            for index, video in enumerate(lessons, start=1):
                 name = fix_filename(video['name'])
                 print(f'\n正在下载 {index}/{len(lessons)} <{course_name}> {name}')
-                if (filepath := self.download_dir / course_name / name).exists():
+                if video['name'] in downloaded:
                     print(f'已存在 {index}/{len(lessons)} <{course_name}> {name}')
                     continue
-                print(f'下载状态: {self.下载媒资(url, filepath)}, {index}/{len(lessons)} <{course_name}> {name}')
+                filepath = self.download_dir / course_name / name
+                print(f'下载状态: {self.下载媒资(video["url"], filepath)}, {index}/{len(lessons)} <{course_name}> {name}')
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(usage='知乎知学堂', description=' --help')
+    parser.add_argument('-c', '--cookie', type=str, default='', help='cookie', dest='cookie')
+    parser.add_argument('-d', '--download-dir', type=str, default=r'C:\Download\知乎知学堂', help='download dir',
+                        dest='download_dir')
+    parser.add_argument('--verify', action='store_true', help='re-download indexed files that are missing or truncated',
+                        dest='verify')
+    parser.add_argument('--cache-dir', type=str, default='', help='enable the download cache in this dir',
+                        dest='cache_dir')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    cache_dir = Path(args.cache_dir) if args.cache_dir else None
+    知学堂(args.cookie, Path(args.download_dir), args.verify, cache_dir).下载所有课程()
 
 
 if __name__ == '__main__':
-    ck = ""
-    zxt = 知学堂(ck)
-    zxt.下载所有课程()
+    main()
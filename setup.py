@@ -27,6 +27,7 @@ setup(
     entry_points={
         'console_scripts': [
             'md5creator=utils.md5creator:main',
+            'funny=utils.cli:main',
         ]
     },
     classifiers=[
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/24 11:05
+# @Version     : Python 3.12.2
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class RangeServer(ThreadingHTTPServer):
+    """
+    支持Range请求的本地服务, 可以让指定起始位置的第一个请求卡住
+
+    路径以 /expired 开头的请求返回403, 模拟失效的签名地址
+    """
+    daemon_threads = True
+
+    def __init__(self, data: bytes):
+        super().__init__(('127.0.0.1', 0), RangeHandler)
+        self.data = data
+        # 随机延迟每个数据块, 打乱切片完成的顺序
+        self.jitter = 0.0
+        # 起始位置为stall_start的第一个请求, 发送stall_after字节后卡住stall秒
+        self.stall_start = None
+        self.stall_after = 0
+        self.stall = 0.0
+        # 切片请求(Range带结束位置)已发送的字节数
+        self.sent = 0
+        # 响应的ETag, conditional 为True时If-None-Match一致返回304
+        self.etag = None
+        self.conditional = True
+        self.paths = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}/file.bin'
+
+    def expired_url(self, name: str = 'file.bin') -> str:
+        return f'http://127.0.0.1:{self.server_port}/expired/{name}'
+
+    def handle_error(self, request, client_address):
+        # 客户端主动断开连接, 忽略
+        pass
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server: RangeServer = self.server
+        data = server.data
+        with server.lock:
+            server.paths.append(self.path)
+        if self.path.startswith('/expired'):
+            self.send_response(403)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if server.etag and server.conditional and self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.send_header('ETag', server.etag)
+            self.end_headers()
+            return
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        start = int(match.group(1)) if match else 0
+        end = int(match.group(2)) if match and match.group(2) else len(data) - 1
+        body = data[start:end + 1]
+        with server.lock:
+            stall = start == server.stall_start
+            if stall:
+                server.stall_start = None
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        self.end_headers()
+        for position in range(0, len(body), 16 * 1024):
+            if stall and position >= server.stall_after:
+                time.sleep(server.stall)
+                stall = False
+            if server.jitter:
+                time.sleep(random.random() * server.jitter)
+            self.wfile.write(body[position:position + 16 * 1024])
+            self.wfile.flush()
+            if match and match.group(2):
+                with server.lock:
+                    server.sent += len(body[position:position + 16 * 1024])
+
+
+@pytest.fixture
+def range_server():
+    server = RangeServer(os.urandom(1024 * 1024 + 17))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/25 14:05
+# @Version     : Python 3.12.2
+import logging
+import os
+import time
+
+import pytest
+import requests
+
+from download import Downloader
+from download.cache import CacheEntry, DownloadCache
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DownloadCache(tmp_path / 'cache', logger=logger)
+    yield cache
+    cache.close()
+
+
+def download(server, cache, path):
+    return Downloader(server.url, {}, path.with_name(f'{path.name}.temp'), path, logger, cache=cache).start()
+
+
+@pytest.mark.parametrize('conditional', [True, False])
+def test_hit_when_etag_matches(range_server, cache, tmp_path, conditional):
+    range_server.etag = '"v1"'
+    first = download(range_server, cache, tmp_path / 'first')
+    assert not first.is_cache_hit and first.cache_entry is not None
+    range_server.conditional = conditional
+    range_server.paths.clear()
+    second = download(range_server, cache, tmp_path / 'second')
+    assert second.is_cache_hit
+    # 只发送验证缓存的请求, 不下载切片
+    assert len(range_server.paths) == 1
+    assert (tmp_path / 'second').read_bytes() == range_server.data
+    # 输出文件是副本, 修改后不影响缓存
+    (tmp_path / 'second').write_bytes(b'changed')
+    assert cache.object_path(first.cache_entry.digest).read_bytes() == range_server.data
+
+
+def test_miss_when_etag_changes(range_server, cache, tmp_path):
+    range_server.etag = '"v1"'
+    download(range_server, cache, tmp_path / 'first')
+    range_server.etag = '"v2"'
+    range_server.data = os.urandom(len(range_server.data))
+    second = download(range_server, cache, tmp_path / 'second')
+    assert not second.is_cache_hit
+    assert (tmp_path / 'second').read_bytes() == range_server.data
+    assert cache.lookup(range_server.url).etag == '"v2"'
+
+
+def test_not_cached_without_validators(range_server, cache, tmp_path):
+    downloader = download(range_server, cache, tmp_path / 'first')
+    assert downloader.is_all_tasks_confirmed and downloader.cache_entry is None
+    assert cache.lookup(range_server.url) is None
+
+
+def test_is_fresh_checks_size():
+    entry = CacheEntry('key', 'digest', '"v1"', None, 100)
+    response = requests.Response()
+    response.status_code = 206
+    response.headers['ETag'] = '"v1"'
+    assert DownloadCache.is_fresh(entry, response, 100)
+    assert not DownloadCache.is_fresh(entry, response, 101)
+    response.headers['ETag'] = '"v2"'
+    assert not DownloadCache.is_fresh(entry, response, 100)
+
+
+def store(cache, tmp_path, key, size=100):
+    (path := tmp_path / key).write_bytes(os.urandom(size))
+    entry = cache.store(key, path, etag=f'"{key}"')
+    # access_time 相同时淘汰顺序不确定
+    time.sleep(0.01)
+    return entry
+
+
+def test_evict_least_recently_used(cache, tmp_path):
+    cache.max_size = 250
+    a = store(cache, tmp_path, 'a')
+    store(cache, tmp_path, 'b')
+    cache.materialize(a, tmp_path / 'a.out')
+    store(cache, tmp_path, 'c')
+    assert cache.lookup('b') is None
+    assert cache.lookup('a') is not None and cache.lookup('c') is not None
+    assert cache.total_size() == 200
+
+
+def test_evict_skips_broken_entries(cache, tmp_path):
+    cache.max_size = 250
+    a = store(cache, tmp_path, 'a')
+    store(cache, tmp_path, 'b')
+    cache.object_path(a.digest).unlink()
+    # 丢失的缓存被删除后总大小不超过上限, 不再淘汰正常的缓存
+    store(cache, tmp_path, 'c')
+    assert cache.lookup('b') is not None and cache.lookup('c') is not None
+    assert cache.total_size() == 200
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/24 14:20
+# @Version     : Python 3.12.2
+import logging
+import math
+import time
+
+import pytest
+
+from download import Downloader, DownloadStatus
+from download.exceptions import DownloadSuccess
+from download.tasks import TaskTable
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize('stall_after', [0, 64 * 1024])
+def test_hedge_wins_on_stalled_slice(range_server, tmp_path, caplog, stall_after):
+    # 卡住中间的切片, 对冲应选择该切片而不是序号最小的切片
+    range_server.stall_start = math.ceil(len(range_server.data) / 5) * 2
+    range_server.stall_after = stall_after
+    range_server.stall = 3
+    downloader = Downloader(range_server.url, {}, tmp_path / 'temp', tmp_path / 'out', logger, threads_num=5)
+    downloader.chunk_size = 16 * 1024
+    start_time = time.time()
+    with caplog.at_level(logging.DEBUG, logger=__name__):
+        downloader.start()
+    assert time.time() - start_time < 2
+    assert downloader.is_all_tasks_confirmed
+    assert (tmp_path / 'out').read_bytes() == range_server.data
+    assert '对冲下载先完成' in caplog.text
+    # 落后的下载已关闭连接并退出, 临时文件夹已删除
+    assert not downloader.responses
+    assert not (tmp_path / 'temp').exists()
+    assert downloader.hedged_size <= downloader.endgame_ratio * len(range_server.data)
+
+
+def test_no_hedge_without_budget(range_server, tmp_path):
+    downloader = Downloader(range_server.url, {}, tmp_path / 'temp', tmp_path / 'out', logger, threads_num=5)
+    downloader.endgame_ratio = 0
+    downloader.start()
+    assert downloader.hedged_size == 0
+    assert (tmp_path / 'out').read_bytes() == range_server.data
+
+
+class InstantDownloader(Downloader):
+    def download(self, task):
+        return DownloadStatus(DownloadSuccess(), task)
+
+    def merge_ready(self):
+        pass
+
+
+def test_concurrent_is_linear_in_slices(tmp_path):
+    downloader = InstantDownloader('url', {}, tmp_path, tmp_path / 'out', logger, threads_num=1)
+    downloader.tasks = TaskTable.from_range('url', {}, 20000 * 10, 10)
+    start_time = time.time()
+    downloader.concurrent()
+    assert downloader.is_all_tasks_confirmed
+    # 每完成一个任务都遍历全部任务时需要数分钟
+    assert time.time() - start_time < 10
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/24 10:40
+# @Version     : Python 3.12.2
+import errno
+import logging
+import os
+
+import pytest
+
+from download.exceptions import MediaMergeError
+from download.merger import FileMerger, copy_by_read_write
+
+logger = logging.getLogger(__name__)
+
+
+def make_files(tmp_path, sizes):
+    files, data = [], b''
+    for index, size in enumerate(sizes):
+        content = os.urandom(size)
+        (file := tmp_path / f'{index:05}').write_bytes(content)
+        files.append(file)
+        data += content
+    return files, data
+
+
+def test_merge_removes_slices(tmp_path):
+    files, data = make_files(tmp_path, [1000, 2001, 3])
+    merger = FileMerger(tmp_path / 'out.part', logger)
+    for file in files:
+        merger.append(file)
+    assert merger.commit(tmp_path / 'out')
+    assert (tmp_path / 'out').read_bytes() == data
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['out']
+
+
+@pytest.mark.parametrize('error', [errno.EXDEV, errno.ENOTSOCK, errno.EINVAL])
+def test_fallback_when_first_method_fails(tmp_path, error):
+    def broken(fd_in, fd_out, size):
+        # 失败前已写入部分数据, 退回时需要恢复
+        os.write(fd_out, os.read(fd_in, 10))
+        raise OSError(error, os.strerror(error))
+
+    files, data = make_files(tmp_path, [100, 200, 300])
+    merger = FileMerger(tmp_path / 'out.part', logger)
+    merger.methods = [broken]
+    for file in files:
+        merger.append(file)
+    merger.commit(tmp_path / 'out')
+    assert (tmp_path / 'out').read_bytes() == data
+    assert merger.methods == []
+
+
+def test_unexpected_error_is_raised(tmp_path):
+    def broken(fd_in, fd_out, size):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+    files, _ = make_files(tmp_path, [100, 200])
+    merger = FileMerger(tmp_path / 'out.part', logger)
+    merger.methods = [broken]
+    merger.append(files[0])
+    with pytest.raises(OSError):
+        merger.append(files[1])
+    merger.abort()
+    assert not (tmp_path / 'out.part').exists()
+
+
+def test_append_prefix_keeps_file(tmp_path):
+    files, data = make_files(tmp_path, [100, 200, 50])
+    merger = FileMerger(tmp_path / 'out.part', logger)
+    merger.methods = [copy_by_read_write]
+    merger.append(files[0], 60, remove=False)
+    merger.append(files[1])
+    merger.append(files[2], 0, remove=False)
+    merger.commit(tmp_path / 'out')
+    assert (tmp_path / 'out').read_bytes() == data[:60] + data[100:300]
+    assert files[0].exists() and not files[1].exists()
+
+
+@pytest.mark.parametrize('index', [0, 1])
+def test_missing_slice_is_raised(tmp_path, index):
+    files, _ = make_files(tmp_path, [100, 200])
+    files[index].unlink()
+    merger = FileMerger(tmp_path / 'out.part', logger)
+    with pytest.raises(MediaMergeError):
+        for file in files:
+            merger.append(file)
+    merger.abort()
+    assert not (tmp_path / 'out').exists()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/25 10:10
+# @Version     : Python 3.12.2
+import time
+
+import pytest
+
+from plugins.cache import MetadataCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = MetadataCache(tmp_path / 'cache' / 'cache.sqlite3')
+    yield cache
+    cache.close()
+
+
+def test_response_expires_after_ttl(cache):
+    cache.set('courses', [{'id': 1, 'name': '课程'}], 0.05)
+    cache.set('catalog:1', {'files': []}, 60)
+    assert cache.get('courses') == [{'id': 1, 'name': '课程'}]
+    time.sleep(0.1)
+    assert cache.get('courses') is None
+    assert cache.get('catalog:1') == {'files': []}
+    assert cache.get('missing') is None
+
+
+def test_completed_index_is_trusted_without_verify(cache, tmp_path):
+    (path := tmp_path / 'video.mp4').write_bytes(b'0' * 100)
+    cache.mark_completed(path)
+    path.unlink()
+    # 默认只查询索引, 不访问文件
+    assert cache.is_indexed(path)
+    assert cache.is_completed(path)
+
+
+@pytest.mark.parametrize('content', [None, b'0' * 99, b'0' * 101])
+def test_verify_discards_missing_or_truncated(cache, tmp_path, content):
+    (path := tmp_path / 'video.mp4').write_bytes(b'0' * 100)
+    cache.mark_completed(path, checksum='sha256')
+    if content is None:
+        path.unlink()
+    else:
+        path.write_bytes(content)
+    assert not cache.is_completed(path, verify=True)
+    # 记录已删除, 下次运行重新下载
+    assert not cache.is_indexed(path)
+    reopened = MetadataCache(cache.path)
+    assert not reopened.is_indexed(path)
+    reopened.close()
+
+
+def test_completed_index_persists(cache, tmp_path):
+    (path := tmp_path / 'video.mp4').write_bytes(b'0' * 100)
+    cache.mark_completed(path)
+    reopened = MetadataCache(cache.path)
+    assert reopened.is_completed(path, verify=True)
+    reopened.discard(path)
+    assert not reopened.is_indexed(path)
+    reopened.close()
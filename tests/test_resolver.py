@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/25 10:40
+# @Version     : Python 3.12.2
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from download import Downloader
+from download.resolver import UrlResolver
+
+logger = logging.getLogger(__name__)
+
+
+class Fetch(object):
+    """记录每个键的解析次数"""
+
+    def __init__(self, url: str = 'http://127.0.0.1/{key}'):
+        self.url = url
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def __call__(self, key: str) -> str:
+        with self.lock:
+            self.counts[key] += 1
+        return self.url.format(key=key, now=int(time.time()))
+
+
+def test_prefetch_stays_within_window():
+    fetch = Fetch()
+    keys = [f'k{i}' for i in range(10)]
+    resolver = UrlResolver(fetch, keys, logger, window=3)
+    assert resolver.resolve('k0') == 'http://127.0.0.1/k0'
+    wait(resolver.futures.values())
+    assert set(fetch.counts) == {'k0', 'k1', 'k2', 'k3'}
+    resolver.resolve('k5')
+    wait(resolver.futures.values())
+    assert set(fetch.counts) == {'k0', 'k1', 'k2', 'k3', 'k5', 'k6', 'k7', 'k8'}
+    # 已预解析的地址不重复请求
+    resolver.resolve('k1')
+    assert fetch.counts['k1'] == 1
+    resolver.close()
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('http://a/b?Expires=2000000000&sign=x', 2000000000 - 60),
+    ('http://a/b?x-oss-expires=2000000000', 2000000000 - 60),
+    ('http://a/b?deadline=2000000000', 2000000000 - 60),
+    # 不是时间戳的参数按ttl计算
+    ('http://a/b?e=123', None),
+    ('http://a/b', None),
+])
+def test_expire_time(url, expected):
+    resolver = UrlResolver(Fetch(), [], logger, ttl=600, margin=60)
+    if expected is None:
+        assert abs(resolver.expire_time(url) - (time.time() + 540)) < 5
+    else:
+        assert resolver.expire_time(url) == expected
+    resolver.close()
+
+
+def test_expired_url_is_resolved_again():
+    fetch = Fetch('http://127.0.0.1/{key}?expires={now}')
+    resolver = UrlResolver(fetch, ['k0'], logger, margin=60)
+    resolver.resolve('k0')
+    assert fetch.counts['k0'] == 2
+    resolver.close()
+
+
+def test_slices_re_resolve_on_403(range_server, tmp_path):
+    fetch = Fetch(range_server.url)
+    downloader = Downloader(range_server.url, {}, tmp_path / 'temp', tmp_path / 'out', logger, threads_num=5,
+                            resolver=lambda: fetch('file'))
+    downloader.tasks = downloader.build_tasks()
+    # 所有切片同时遇到失效的地址, 只重新解析一次
+    downloader.tasks.set_url(range_server.expired_url())
+    downloader.temp_dir.mkdir()
+    downloader.concurrent()
+    assert downloader.merge_temp_files()
+    assert (tmp_path / 'out').read_bytes() == range_server.data
+    assert fetch.counts['file'] == 1
+    assert downloader.expired_urls == {range_server.expired_url()}
+
+
+def test_probe_re_resolves_on_403(range_server, tmp_path):
+    fetch = Fetch(range_server.url)
+    downloader = Downloader(range_server.expired_url(), {}, tmp_path / 'temp', tmp_path / 'out', logger,
+                            resolver=lambda: fetch('file')).start()
+    assert downloader.is_all_tasks_confirmed
+    assert (tmp_path / 'out').read_bytes() == range_server.data
+
+
+def test_refresh_stops_after_max_times(range_server, tmp_path):
+    fetch = Fetch(range_server.expired_url('{key}-{now}'))
+    counter = iter(range(100))
+    downloader = Downloader(range_server.expired_url(), {}, tmp_path / 'temp', tmp_path / 'out', logger,
+                            resolver=lambda: fetch(str(next(counter))))
+    url = downloader.url
+    for _ in range(downloader.max_times):
+        assert downloader.refresh_url(url)
+        # 其他线程使用同一个失效地址时不再重新解析
+        assert downloader.refresh_url(url)
+        url = downloader.url
+    assert not downloader.refresh_url(url)
+    assert sum(fetch.counts.values()) == downloader.max_times
+
+
+def test_download_stops_when_urls_keep_expiring(range_server, tmp_path):
+    fetch = Fetch(range_server.expired_url('{key}'))
+    counter = iter(range(100))
+    downloader = Downloader(range_server.url, {}, tmp_path / 'temp', tmp_path / 'out', logger, threads_num=5,
+                            resolver=lambda: fetch(str(next(counter))))
+    downloader.tasks = downloader.build_tasks()
+    downloader.tasks.set_url(range_server.expired_url())
+    downloader.temp_dir.mkdir()
+    downloader.concurrent()
+    assert not downloader.is_all_tasks_confirmed
+    assert downloader.is_stop_all and downloader.status_code == 403
+    assert sum(fetch.counts.values()) == downloader.max_times
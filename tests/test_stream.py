@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/24 11:30
+# @Version     : Python 3.12.2
+import logging
+import time
+
+from download import Downloader
+
+logger = logging.getLogger(__name__)
+
+
+def build_downloader(server, tmp_path) -> Downloader:
+    downloader = Downloader(server.url, {}, tmp_path / 'temp', tmp_path / 'out', logger, threads_num=4)
+    downloader.chunk_size = 16 * 1024
+    return downloader
+
+
+def test_stream_returns_bytes_in_order(range_server, tmp_path):
+    range_server.jitter = 0.002
+    downloader = build_downloader(range_server, tmp_path)
+    chunks = []
+    with downloader.stream(slice_size=64 * 1024, memory_size=192 * 1024) as stream:
+        assert stream.buffer_num == 3
+        while chunk := stream.read(7777):
+            chunks.append(chunk)
+    assert b''.join(chunks) == range_server.data
+    assert downloader.is_all_tasks_confirmed
+    # 流式下载不修改下载器的切片大小
+    assert downloader.slice_size is None
+    assert not (tmp_path / 'temp').exists()
+
+
+def test_iter_slices(range_server, tmp_path):
+    downloader = build_downloader(range_server, tmp_path)
+    with downloader.stream(slice_size=100 * 1024, memory_size=100 * 1024) as stream:
+        slices = list(stream.iter_slices())
+    assert [len(data) for data in slices[:-1]] == [100 * 1024] * (len(slices) - 1)
+    assert b''.join(slices) == range_server.data
+
+
+def test_close_stops_running_fetches(range_server, tmp_path):
+    # 第二个切片发送部分数据后卡住, 关闭时只有断开连接才能让该下载退出
+    range_server.stall_start = 256 * 1024
+    range_server.stall_after = 64 * 1024
+    range_server.stall = 3
+    downloader = build_downloader(range_server, tmp_path)
+    stream = downloader.stream(slice_size=256 * 1024, memory_size=1024 * 1024)
+    assert stream.read(10) == range_server.data[:10]
+    stream.close()
+    # 执行中的下载在关闭后很快退出, 服务端不再发送数据
+    deadline = time.time() + 1
+    while any(thread.is_alive() for thread in stream.executor._threads) and time.time() < deadline:
+        time.sleep(0.01)
+    assert not any(thread.is_alive() for thread in stream.executor._threads)
+    time.sleep(0.1)
+    sent = range_server.sent
+    time.sleep(0.3)
+    assert range_server.sent == sent < len(range_server.data)
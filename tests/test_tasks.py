@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/24 10:15
+# @Version     : Python 3.12.2
+import types
+
+import pytest
+
+from download import Task
+from download.tasks import TaskTable
+
+
+def test_from_range_covers_whole_file():
+    table = TaskTable.from_range('url', {'a': 'b'}, 1001, 100)
+    assert len(table) == 11
+    assert table[0].slice == (0, 0, 99)
+    assert table[-1].slice == (1000, 0, 1000)
+    assert sum(end - start + 1 for start, _, end in (task.slice for task in table)) == 1001
+    assert [task.serial_number for task in table] == list(range(11))
+
+
+def test_confirm_and_unconfirm_update_remaining():
+    table = TaskTable.from_range('url', {}, 50, 10)
+    assert table.remaining == 5
+    table.confirm(1)
+    table[3].confirmed = True
+    # 重复确认不影响计数
+    table.confirm(1)
+    assert table.remaining == 3
+    assert [task.index for task in table.pending_tasks()] == [0, 2, 4]
+    assert table[1].confirmed and not table[0].confirmed
+    table[1].confirmed = False
+    assert table.remaining == 4
+    assert not table[1].confirmed
+    assert sorted(task.index for task in table.pending_tasks()) == [0, 1, 2, 4]
+
+
+def test_view_writes_through_to_table():
+    table = TaskTable.from_range('url', {'user-agent': 'x'}, 30, 10)
+    task = table[1]
+    task.slice = (10, 4, 19)
+    task.download_times += 1
+    task.url = 'other'
+    assert table[1].slice == (10, 4, 19)
+    assert table[1].download_times == 1
+    assert table[1].url == 'other' and table[0].url == 'url'
+    table.set_url('new')
+    assert [task.url for task in table] == ['new'] * 3
+
+
+def test_headers_are_shared_and_read_only():
+    table = TaskTable.from_range('url', {'user-agent': 'x'}, 30, 10)
+    assert isinstance(table[0].headers, types.MappingProxyType)
+    assert table[0].headers is table[2].headers
+    with pytest.raises(TypeError):
+        table[0].headers['range'] = 'bytes=0-'
+
+
+def test_from_tasks_keeps_task_state():
+    table = TaskTable.from_tasks([
+        Task('u', (0, 0, 9), {}, 7),
+        Task('v', (10, 3, 19), {}, 8, download_times=2, confirmed=True),
+    ])
+    assert table.remaining == 1
+    assert table[1].slice == (10, 3, 19)
+    assert table[1].url == 'v'
+    assert table[1].download_times == 2
+    assert [task.serial_number for task in table] == [7, 8]
+
+
+def test_index_out_of_range():
+    table = TaskTable.from_range('url', {}, 30, 10)
+    with pytest.raises(IndexError):
+        table[3]
+    assert TaskTable('url', {}, ()).remaining == 0
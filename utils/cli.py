@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# @Author      : LJQ
+# @Time        : 2024/6/21 15:12
+# @Version     : Python 3.12.2
+"""
+统一命令行入口
+
+    funny <命令> [参数...]
+
+命令以 "模块:函数" 的字符串登记, 执行时才导入对应模块, 启动时不导入requests等较重的依赖
+"""
+import sys
+
+import plugins
+
+# 命令名: (命令函数, 描述)
+COMMANDS = {
+    'md5': ('utils.md5creator:main', 'create md5sum of each chunk of a file'),
+    'download': ('download.__main__:main', 'multi-threaded downloader, "-o -" streams to stdout'),
+}
+
+
+def usage(commands: dict) -> str:
+    width = max(map(len, commands), default=0)
+    lines = ['usage: funny <command> [args...]', '', 'commands:']
+    for name, (_, description) in commands.items():
+        lines.append(f'  {name:<{width}}  {description}')
+    return '\n'.join(lines)
+
+
+def main(argv: list = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ['-h', '--help', '-l', '--list']:
+        print(usage({**COMMANDS, **plugins.discover()}))
+        sys.exit(0 if argv else 2)
+    name, args = argv[0], argv[1:]
+    target = COMMANDS[name][0] if name in COMMANDS else plugins.find(name)
+    if target is None:
+        print(f'unknown command: {name}\n\n{usage({**COMMANDS, **plugins.discover()})}', file=sys.stderr)
+        sys.exit(2)
+    return plugins.load(target)(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -56,7 +56,7 @@ def md5creator(args):
     print(f'Completed! Output file named "{output_file}"')
 
 
-def main():
+def main(argv: list = None):
     parser = argparse.ArgumentParser(usage='MD5 Creator', description=' --help')
     parser.add_argument(dest='input', type=str, help='input file')
     parser.add_argument('-o', '--output', required=False, type=str, help='output file', dest='output')
@@ -65,7 +65,7 @@ def main():
     parser.add_argument('-s', '--show', action='store_true', help='show each chunk md5sum', dest='show')
     error_code = 0
     try:
-        md5creator(parser.parse_args(sys.argv[1:]))
+        md5creator(parser.parse_args(sys.argv[1:] if argv is None else argv))
     except (KeyboardInterrupt, Exception):
         traceback.print_exc()
         error_code = 130